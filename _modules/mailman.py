@@ -10,14 +10,27 @@ from __future__ import absolute_import
 
 import sys, os
 import subprocess
-import re
+import hashlib
+import fcntl
 import tempfile
-from email.utils import parseaddr
+from email.utils import parseaddr, formataddr
+
+# Import salt libs
+import salt.utils
 
 # Some constants
 MM_PATH = "/var/lib/mailman/bin"
 DEFAULT_OWNER = "root@localhost.localdomain"
 
+# Enlarge the stdin pipe for payloads bigger than this, so large
+# member lists can be written without stalling on a full pipe
+LARGE_STDIN = 32 * 1024
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+STDIN_PIPE_SIZE = 1 << 20
+
+# Unlocked MailList objects, keyed by the lowercased list name
+_MLIST_CACHE = {}
+
 
 # Try to import Mailman helper. If it fails, continue.
 # As long as no function gets called, this doesn't hurt.
@@ -34,10 +47,82 @@ except ImportError:
 
 # This function is called by salt to check if this module is operational
 def __virtual__():
-    if subprocess.call(['which', 'list_members'], stdout=subprocess.PIPE) == 0:
-        return 'mailman'
+    if int(__grains__['saltversioninfo'][0]) >= 2018:
+        if salt.utils.path.which('list_members'):
+            return 'mailman'
     else:
-        return False, 'It seems, that mailman is not installed'
+        if salt.utils.which('list_members'):
+            return 'mailman'
+    return False, 'It seems, that mailman is not installed'
+
+############################################################################
+# Private functions
+############################################################################
+
+# Run a mailman command line tool, optionally feeding data to its stdin
+def _run(cmd, stdin_data=None):
+    if stdin_data is not None:
+        stdin = subprocess.PIPE
+    else:
+        stdin = None
+    p = subprocess.Popen(cmd,
+            bufsize=-1,
+            stdout=subprocess.PIPE,
+            stdin=stdin,
+            close_fds=True)
+    if stdin_data is not None and len(stdin_data) > LARGE_STDIN:
+        # Only supported on linux, the default size works as well
+        try:
+            fcntl.fcntl(p.stdin.fileno(), F_SETPIPE_SZ, STDIN_PIPE_SIZE)
+        except (IOError, OSError):
+            pass
+    out, _ = p.communicate(stdin_data)
+    return p.returncode, out
+
+# Join lines for the stdin of a command line tool, which expects bytes
+def _stdin_lines(lines):
+    payload = '\n'.join(lines) + '\n'
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    return payload
+
+# Encapsulate single values as a list, sequences are converted to a list
+def _as_list(x):
+    if isinstance(x, (list, tuple, set, frozenset)):
+        return list(x)
+    return [x]
+
+# Return an unlocked MailList object for reading. The object is reused
+# as long as the config.pck of the list hasn't changed, so loading the
+# list config isn't repeated for every lookup. Don't modify it, use a
+# locked MailList object for changes and call _forget_mlist afterwards.
+def _get_mlist(name):
+    name = name.lower()
+    try:
+        st = os.stat(os.path.join(mm_cfg.LIST_DATA_DIR, name, 'config.pck'))
+        stamp = (st.st_mtime, st.st_size)
+    except OSError:
+        stamp = None
+
+    cached = _MLIST_CACHE.get(name)
+    if stamp is not None and cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    l = MailList.MailList(name, lock=0)
+    if stamp is not None:
+        _MLIST_CACHE[name] = (stamp, l)
+    return l
+
+# Drop the cached MailList object of a list after it has been changed
+def _forget_mlist(name):
+    _MLIST_CACHE.pop(name.lower(), None)
+
+# Read all member addresses of a list through the mailman python API.
+# This avoids forking list_members for every lookup. Mailman keeps the
+# addresses lowercased, so they can be compared to normalized input.
+def _roster(name):
+    l = _get_mlist(name)
+    return l, set(l.getMembers())
 
 ############################################################################
 # Public functions
@@ -70,6 +155,9 @@ def add_list(name, **kwargs):
     owner = DEFAULT_OWNER
     if 'owner' in kwargs:
         owner = kwargs['owner']
+        # newlist takes a single owner, further owners have to be
+        # configured with set_owner afterwards
+        owner = _as_list(owner)[0]
 
     if 'password' in kwargs:
         password = kwargs['password']
@@ -77,31 +165,23 @@ def add_list(name, **kwargs):
         password = Utils.MakeRandomPassword(
                 mm_cfg.ADMIN_PASSWORD_LENGTH)
     
+    # We use the commandline tools, because they do a lot of checks,
+    # we don't want to reimplement all of them.
+    cmd = ['%s/newlist' % MM_PATH]
+
     # Add optional arguments
-    args = ''
     if 'language' in kwargs:
-        args = args + " -l %s" % kwargs['language']
+        cmd += ['-l', kwargs['language']]
 
     if 'urlhost' in kwargs:
-        args = args + " -u %s" % kwargs['urlhost']
+        cmd += ['-u', kwargs['urlhost']]
 
     if 'emailhost' in kwargs:
-        args = args + " -e %s" % kwargs['emailhost']
-    
-    # We use the commandline tools, because they do a lot of checks,
-    # we don't want to reimplement all of them.
-    if len(args) > 0:
-        cmdline = "%s/newlist %s %s %s %s" % (MM_PATH, args.strip(), name, owner, password)
-    else:
-        cmdline = "%s/newlist %s %s %s" % (MM_PATH, name, owner, password)
+        cmd += ['-e', kwargs['emailhost']]
 
-    cmd = cmdline.split(' ')
-    p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE)
-    p.communicate('\n')
-    p.wait()
-    if p.returncode == 0:
+    cmd += [name, owner, password]
+    rc, out = _run(cmd, stdin_data=b'\n')
+    if rc == 0:
         return True
     return False, 'Could not add list %s, something went wrong' % name
 
@@ -126,33 +206,43 @@ def remove_list(name, archives=True):
     else:
         cmd = ['%s/rmlist' % MM_PATH, name]
 
-    p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE)
-    p.wait()
-    if p.returncode == 0:
+    rc, out = _run(cmd)
+    _forget_mlist(name)
+    if rc == 0:
         return True
     return False, 'Removal of list %s failed' % name
 
 
-# List members
+# Set of the lowercased addresses of all members, for fast lookups
+def list_members_set(name):
+    # If list <name> doesn't exist, exit
+    if not list_present(name):
+        return False, 'List is not present on this system'
+
+    l, roster = _roster(name)
+    return frozenset(roster)
+
+# List members, without fullnames the lowercased addresses are returned
 def list_members(name, fullnames=False):
+    if not fullnames:
+        roster = list_members_set(name)
+        if not isinstance(roster, frozenset):
+            return roster
+        return sorted(roster)
+
     # If list <name> doesn't exist, exit
     if not list_present(name):
         return False, 'List is not present on this system'
 
+    l, roster = _roster(name)
     members = []
-    if fullnames:
-        cmd = [ '%s/list_members' % MM_PATH, '-f', name ]
-    else:
-        cmd = [ '%s/list_members' % MM_PATH, name ]
-    p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE)
-    p.wait()
-    if p.returncode == 0:
-        for line in p.stdout:
-            members.append(line.strip())
-        return members
-    return False
+    for addr in sorted(roster):
+        realname = l.getMemberName(addr)
+        if realname:
+            members.append(formataddr((realname, addr)))
+        else:
+            members.append(addr)
+    return members
 
 # Check if email address is member of a list
 def is_member(name, email):
@@ -160,17 +250,8 @@ def is_member(name, email):
     if not list_present(name):
         return False, 'List is not present on this system'
 
-    email = parseaddr(email)
-
-    cmd = [ '%s/list_members' % MM_PATH, name ]
-    p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE)
-    p.wait()
-    if p.returncode == 0:
-        for line in p.stdout:
-            if re.match("^"+email[1]+"$", line):
-                return True
-    return False
+    l, roster = _roster(name)
+    return parseaddr(email)[1].lower() in roster
 
 # Add memebers to the list
 def add_member(name, members):
@@ -191,16 +272,12 @@ def add_member(name, members):
         return False, 'List is not present on this system'
 
     # if members is not a list, encapsulate it as a list
-    if not type(members) == list:
-        members = [ members ]
+    members = _as_list(members)
 
     cmd = ['%s/add_members' % MM_PATH, '-r', '-', name]
-    p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE)
-    p.communicate('\n'.join(members))
-    p.wait()
-    if p.returncode == 0:
+    rc, out = _run(cmd, stdin_data=_stdin_lines(members))
+    _forget_mlist(name)
+    if rc == 0:
         return True
     return False, 'Could not add members to list %s, somethin went wrong' % name
 
@@ -223,8 +300,7 @@ def remove_member(name, members):
         return False, 'List is not present on this system'
 
     # if members is not a list, encapsulate it as a list
-    if not type(members) == list:
-        members = [ members ]
+    members = _as_list(members)
 
     # Strip fullnames in Mailadresses
     del_members = []
@@ -233,12 +309,9 @@ def remove_member(name, members):
         del_members.append(m_tuple[1])
 
     cmd = ['%s/remove_members' % MM_PATH, '-f', '-', name]
-    p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE)
-    p.communicate('\n'.join(del_members))
-    p.wait()
-    if p.returncode == 0:
+    rc, out = _run(cmd, stdin_data=_stdin_lines(del_members))
+    _forget_mlist(name)
+    if rc == 0:
         return True
     return False, 'Removal of members on list %s failed' % name
 
@@ -247,8 +320,8 @@ def get_owner(name):
     Get the email address of the person who runs this list
     '''
 
-    l = MailList.MailList(name.lower(), lock=0)
-    return l.owner
+    l = _get_mlist(name)
+    return list(l.owner)
 
 def set_owner(name, owner):
     '''
@@ -257,8 +330,7 @@ def set_owner(name, owner):
     Mailman supports a set of owners. 
     '''
 
-    if not type(owner) == list:
-        owner = [owner]
+    owner = _as_list(owner)
 
     l = MailList.MailList(name.lower())
     try:
@@ -266,6 +338,7 @@ def set_owner(name, owner):
         l.Save()
     finally:
         l.Unlock()
+        _forget_mlist(name)
     return True
 
 
@@ -277,20 +350,23 @@ def set_list_password(name, password):
     l = MailList.MailList(name.lower(), lock=0)
     if len(password) < 1:
         return False, 'Empty passwords are not allowed'
-    shapassword = Utils.sha_new(password).hexdigest()
+    if not isinstance(password, bytes):
+        password = password.encode('utf-8')
+    shapassword = hashlib.sha1(password).hexdigest()
     l.Lock()
     try:
         l.password = shapassword
         l.Save()
     finally:
         l.Unlock()
+        _forget_mlist(name)
     return True
 
 def check_list_password(name, password):
     '''
     Test if password matches the admin password for this list.  
     '''
-    l = MailList.MailList(name.lower(), lock=0)
+    l = _get_mlist(name)
     auth = l.Authenticate([mm_cfg.AuthListAdmin], password)
     if auth == mm_cfg.UnAuthorized:
         return False
@@ -15,6 +15,8 @@ from __future__ import absolute_import
 # Import python libs
 import os
 import re
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from email.utils import parseaddr
 
 # Import salt libs
@@ -36,6 +38,12 @@ def __virtual__():
             return 'mailman'
     return False, 'It seems that mailman is not installed'
 
+# Encapsulate single values as a list, sequences are converted to a list
+def _as_list(x):
+    if isinstance(x, (list, tuple, set, frozenset)):
+        return list(x)
+    return [x]
+
 ############################################################
 # Test if list <name> is present and create one if not
 ############################################################
@@ -71,12 +79,14 @@ def list_present(name, **kwargs):
            'result': True}
 
     # Test if list is present on this system
-    if not __salt__['mailman.list_present'](name):
+    present = __salt__['mailman.list_present'](name)
+    if not present:
         if __opts__['test']:
             ret['comment'] = 'List %s is set to be created' % name
             ret['result'] = None
         else:
             if __salt__['mailman.add_list'](name, **kwargs):
+                present = True
                 ret['comment'] = 'List %s has been updated' % name
                 ret['changes']['Add'] = 'List %s has been created\n' % name
             else:
@@ -86,7 +96,7 @@ def list_present(name, **kwargs):
                 return ret
 
     # If test is True and the list would get created, end here
-    if not __salt__['mailman.list_present'](name) and __opts__['test']:
+    if not present and __opts__['test']:
         return ret
 
     # Check password and set
@@ -106,134 +116,140 @@ def list_present(name, **kwargs):
 
     # Compare owners
     if 'owner' in kwargs:
-        mm_owner = __salt__['mailman.get_owner'](name)
-        # ensure salt_owner is a list
-        if type(kwargs['owner']) == list:
-            salt_owner = kwargs['owner']
-        else:
-            salt_owner = [kwargs['owner']]
+        mm_owner = set(__salt__['mailman.get_owner'](name))
+        salt_owner = set(_as_list(kwargs['owner']))
 
         # Sync owners
-        updated = False
-        for owner in mm_owner:
-            if not owner in salt_owner:
-                mm_owner.remove(owner)
-                updated = True
-        for owner in salt_owner:
-            if not owner in mm_owner:
-                mm_owner.append(owner)
-                updated = True
-
-        if updated:
+        if mm_owner != salt_owner:
+            new_owner = sorted(salt_owner)
             if __opts__['test']:
                 ret['comment'] = 'List %s is set do be updated' % name
                 ret['result'] = None
             else:
-                if __salt__['mailman.set_owner'](name, mm_owner):
+                if __salt__['mailman.set_owner'](name, new_owner):
                     ret['comment'] = 'List %s has been updated' % name
-                    ret['changes']['Owner'] = 'Owner has been changed:\n%s' % '\n'.join(mm_owner)
+                    ret['changes']['Owner'] = 'Owner has been changed:\n%s' % '\n'.join(new_owner)
                 else:
                     ret['comment'] = 'Failed to list list %s' % name
                     ret['result'] = False
                     return ret
-       
+
+    # Fetch the current subscribers once, all membership checks below
+    # are done against this set
+    if 'members_present' in kwargs or 'members_absent' in kwargs or 'explicit' in kwargs:
+        mm_set = __salt__['mailman.list_members_set'](name)
+        if not isinstance(mm_set, frozenset):
+            ret['comment'] = 'Failed to get members of list %s' % name
+            ret['result'] = False
+            return ret
+        current = set(mm_set)
 
     # Check if membership is set correctly
     if 'members_present' in kwargs:
-        members_add = []
-        for m in kwargs['members_present']:
-            # Check if member is already subscribed
-            if not __salt__['mailman.is_member'](name, m):
-                members_add.append(m)
+        members_add = [m for m in kwargs['members_present']
+                       if parseaddr(m)[1].lower() not in current]
         if len(members_add) > 0:
             if __opts__['test']:
                 ret['comment'] = 'List %s is set do be updated' % name
                 ret['result'] = None
-                for m in members_add:
-                    if 'Subscribed' in ret['changes']:
-                        ret['changes']['Subscribed'] = ret['changes']['Subscribed'] + "%s\n" % m
-                    else:
-                        ret['changes']['Subscribed'] = "%s\n" % m
+                ret['changes']['Subscribed'] = '\n'.join(members_add) + '\n'
 
             else:
                 if __salt__['mailman.add_member'](name, members_add):
                     ret['comment'] = 'List %s has been updated' % name
+                    ret['changes']['Subscribed'] = '\n'.join(members_add) + '\n'
                     for m in members_add:
-                        if 'Subscribed' in ret['changes']:
-                            ret['changes']['Subscribed'] = ret['changes']['Subscribed'] + "%s\n" % m
-                        else:
-                            ret['changes']['Subscribed'] = "%s\n" % m
+                        current.add(parseaddr(m)[1].lower())
                 else:
                     ret['result'] = False
                     ret['comment'] = 'Failed to add new members'
                     return ret
 
+    # Collect all members to unsubscribe, remember why each one is removed
+    members_del = []
+    del_addrs = set()
     if 'members_absent' in kwargs:
-        members_del = []
         for m in kwargs['members_absent']:
-            # Check if member is already subscribed
-            if __salt__['mailman.is_member'](name, m):
-                members_del.append(m)
-        if len(members_del) > 0:
-            if __opts__['test']:
-                ret['comment'] = 'List %s is set do be updated' % name
-                ret['result'] = None
-                for m in members_del:
-                    if 'Unsubscribed' in ret['changes']:
-                        ret['changes']['Unsubscribed'] = ret['changes']['Unsubscribed'] + "%s\n" % m
-                    else:
-                        ret['changes']['Unsubscribed'] = "%s\n" % m
-            else:
-                if __salt__['mailman.remove_member'](name, members_del):
-                    ret['comment'] = 'List %s has been updated' % name
-                    for m in members_del:
-                        if 'Unsubscribed' in ret['changes']:
-                            ret['changes']['Unsubscribed'] = ret['changes']['Unsubscribed'] + "%s\n" % m
-                        else:
-                            ret['changes']['Unsubscribed'] = "%s\n" % m
-                else:
-                    ret['result'] = False
-                    ret['comment'] = 'Failed to remove members'
-                    return ret
+            addr = parseaddr(m)[1].lower()
+            if addr in current and addr not in del_addrs:
+                members_del.append((m, ''))
+                del_addrs.add(addr)
 
     # if explicit option is set, ensure that only members listet in members_present are subscribed
     if 'explicit' in kwargs:
-        mm_list = __salt__['mailman.list_members'](name)
-
-        salt_list = []
+        salt_list = set()
         for addr in kwargs['members_present']:
             temp = parseaddr(addr)
-            salt_list.append(temp[1])
+            salt_list.add(temp[1].lower())
 
-        del_list = []
-        for addr in mm_list:
-            if addr not in salt_list:
-                del_list.append(addr)
+        for addr in sorted(current):
+            if addr not in salt_list and addr not in del_addrs:
+                members_del.append((addr, ' (explicit flag)'))
+                del_addrs.add(addr)
 
-        if len(del_list) > 0:
-            if __opts__['test']:
-                ret['comment'] = 'List %s is set do be updated' % name
-                ret['result'] = None
-                for m in del_list:
-                    if 'Unsubscribed' in ret['changes']:
-                        ret['changes']['Unsubscribed'] = ret['changes']['Unsubscribed'] + "%s (explicit flag)\n" % m
-                    else:
-                        ret['changes']['Unsubscribed'] = "%s (explicit flag)\n" % m
+    if len(members_del) > 0:
+        unsubscribed_msgs = ["%s%s" % (m, reason) for m, reason in members_del]
+        if __opts__['test']:
+            ret['comment'] = 'List %s is set do be updated' % name
+            ret['result'] = None
+            ret['changes']['Unsubscribed'] = '\n'.join(unsubscribed_msgs) + '\n'
+        else:
+            if __salt__['mailman.remove_member'](name, [m for m, reason in members_del]):
+                ret['comment'] = 'List %s has been updated' % name
+                ret['changes']['Unsubscribed'] = '\n'.join(unsubscribed_msgs) + '\n'
             else:
-                if __salt__['mailman.remove_member'](name, del_list):
-                    ret['comment'] = 'List %s has been updated' % name
-                    for m in del_list:
-                        if 'Unsubscribed' in ret['changes']:
-                            ret['changes']['Unsubscribed'] = ret['changes']['Unsubscribed'] + "%s (explicit flag)\n" % m
-                        else:
-                            ret['changes']['Unsubscribed'] = "%s (explicit flag)\n" % m
-                else:
-                    ret['result'] = False
-                    ret['comment'] = 'Failed to remove members'
-                    return ret
+                ret['result'] = False
+                ret['comment'] = 'Failed to remove members'
+                return ret
                
     return ret 
 
+def lists_present(name, lists=None):
+    '''
+    Ensure that several lists are present. The lists are handled
+    in parallel, each one as described in list_present.
+
+    * name: string
+        Name of this state, only used for reporting
+
+    * lists: dict
+        Mapping of list names to the arguments of list_present
+    '''
+
+    ret = {'changes': {},
+           'comment': '',
+           'name': name,
+           'result': True}
+
+    if not lists:
+        ret['comment'] = 'No lists given'
+        return ret
+
+    # Most of the work is done by forked mailman tools, so threads
+    # are sufficient to run the lists side by side
+    def _worker(item):
+        return list_present(item[0], **(item[1] or {}))
+
+    workers = min(len(lists), multiprocessing.cpu_count())
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_worker, sorted(lists.items()))
+    finally:
+        pool.close()
+        pool.join()
+
+    comments = []
+    for list_ret in results:
+        comments.append(list_ret['comment'])
+        if list_ret['changes']:
+            ret['changes'][list_ret['name']] = list_ret['changes']
+        if list_ret['result'] is False:
+            ret['result'] = False
+        elif list_ret['result'] is None and ret['result'] is not False:
+            ret['result'] = None
+    ret['comment'] = '\n'.join(comments)
+    return ret
+
 def list_absent(name):
     '''
     Remove any list named <name>
@@ -35,6 +35,14 @@ import re
 import salt.utils
 import salt.ext.six as six
 
+# Human readable sizes as accepted by lv_present and
+# the factor to convert them into kB
+_SIZE_RE = re.compile(r"(\d+)\s*([KMGTkmgt])")
+_UNIT_KB = {'K': 1,
+            'M': 1024,
+            'G': 1024 * 1024,
+            'T': 1024 * 1024 * 1024}
+
 
 def __virtual__():
     '''
@@ -137,20 +145,26 @@ def vg_present(name, devices=None, **kwargs):
 
     if __salt__['lvm.vgdisplay'](name):
         ret['comment'] = 'Volume Group {0} already present'.format(name)
+        # Query all physical volumes at once instead of one call per device
+        all_pvs = __salt__['lvm.pvdisplay'](real=True) or {}
+        realdevs = {}
         for device in devices:
-            realdev = os.path.realpath(device)
-            pvs = __salt__['lvm.pvdisplay'](realdev, real=True)
-            if pvs and pvs.get(realdev, None):
-                if pvs[realdev]['Volume Group Name'] == name:
+            if device not in realdevs:
+                realdevs[device] = os.path.realpath(device)
+            realdev = realdevs[device]
+            pv_entry = all_pvs.get(realdev, None)
+            if pv_entry:
+                if pv_entry['Volume Group Name'] == name:
                     ret['comment'] = '{0}\n{1}'.format(
                         ret['comment'],
                         '{0} is part of Volume Group'.format(device))
-                elif pvs[realdev]['Volume Group Name'] == '#orphans_lvm2':
+                elif pv_entry['Volume Group Name'] == '#orphans_lvm2':
                     __salt__['lvm.vgextend'](name, device)
                     pvs = __salt__['lvm.pvdisplay'](realdev, real=True)
                     if pvs[realdev]['Volume Group Name'] == name:
                         ret['changes'].update(
                             {device: 'added to {0}'.format(name)})
+                        all_pvs[realdev] = pvs[realdev]
                     else:
                         ret['comment'] = '{0}\n{1}'.format(
                             ret['comment'],
@@ -160,7 +174,7 @@ def vg_present(name, devices=None, **kwargs):
                     ret['comment'] = '{0}\n{1}'.format(
                         ret['comment'],
                         '{0} is part of {1}'.format(
-                            device, pvs[realdev]['Volume Group Name']))
+                            device, pv_entry['Volume Group Name']))
                     ret['result'] = False
             else:
                 ret['comment'] = '{0}\n{1}'.format(
@@ -276,39 +290,42 @@ def lv_present(name,
     else:
         lvpath = '/dev/{0}/{1}'.format(vgname, name)
 
-    if __salt__['lvm.lvdisplay'](lvpath):
-        lvdisp = __salt__['lvm.lvdisplay'](lvpath)
-        lvsize = lvdisp[lvpath]['Current Logical Extents Associated']
-        vgdisp = __salt__['lvm.vgdisplay'](vgname)
-        pesize = vgdisp[vgname]['Physical Extent Size (kB)']
-        lvsize = int(lvsize) * int(pesize)
-
-        # convert given (human readable) size to numerical value
-        m = re.match("([0-9]+)([A-Za-z])", size)
-        if m.group(2) == 'T':
-            size_numerical = int(m.group(1)) * 1024 * 1024 * 1024
-        if m.group(2) == 'G':
-            size_numerical = int(m.group(1)) * 1024 * 1024
-        if m.group(2) == 'M':
-            size_numerical = int(m.group(1)) * 1024 
-
-        # check if size differs and resize if pssible
-        if lvsize < size_numerical:
-            __salt__['lvm.lvresize'](size, lvpath)
-
-            lvsize_old = lvsize
-            lvdisp = __salt__['lvm.lvdisplay'](lvpath)
+    lvdisp = __salt__['lvm.lvdisplay'](lvpath)
+    if lvdisp:
+        # Only look at the size if the volume may get resized
+        if not (allow_resize and size):
+            ret['comment'] = 'Logical Volume {0} already present'.format(name)
+        else:
             lvsize = lvdisp[lvpath]['Current Logical Extents Associated']
+            vgdisp = __salt__['lvm.vgdisplay'](vgname)
+            pesize = vgdisp[vgname]['Physical Extent Size (kB)']
             lvsize = int(lvsize) * int(pesize)
-            if lvsize == size_numerical:
-                ret['comment'] = 'Logical Volume {0} has been extended to {1}'.format(name, size)
-                ret['changes']['old'] = lvsize_old
-                ret['changes']['new'] = lvsize
-            else:
-                ret['comment'] = 'Logical Volume {0} already present and could not get resized'.format(name)
+
+            # convert given (human readable) size to numerical value
+            m = _SIZE_RE.match(size)
+            if not m:
+                ret['comment'] = 'Unable to parse size {0} of Logical Volume {1}'.format(size, name)
                 ret['result'] = False
-        else:
-            ret['comment'] = 'Logical Volume {0} already present'.format(name)
+                return ret
+            size_numerical = int(m.group(1)) * _UNIT_KB[m.group(2).upper()]
+
+            # check if size differs and resize if pssible
+            if lvsize < size_numerical:
+                __salt__['lvm.lvresize'](size, lvpath)
+
+                lvsize_old = lvsize
+                lvdisp = __salt__['lvm.lvdisplay'](lvpath)
+                lvsize = lvdisp[lvpath]['Current Logical Extents Associated']
+                lvsize = int(lvsize) * int(pesize)
+                if lvsize == size_numerical:
+                    ret['comment'] = 'Logical Volume {0} has been extended to {1}'.format(name, size)
+                    ret['changes']['old'] = lvsize_old
+                    ret['changes']['new'] = lvsize
+                else:
+                    ret['comment'] = 'Logical Volume {0} already present and could not get resized'.format(name)
+                    ret['result'] = False
+            else:
+                ret['comment'] = 'Logical Volume {0} already present'.format(name)
 
     elif __opts__['test']:
         ret['comment'] = 'Logical Volume {0} is set to be created'.format(name)